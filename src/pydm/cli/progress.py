@@ -0,0 +1,137 @@
+import queue
+import threading
+from collections import defaultdict
+from typing import Optional
+from tqdm import tqdm
+from ..core.models import DownloadState
+
+# Seconds between segment bar redraws. The total bar keeps tqdm's 0.1s default;
+# with one bar per segment, redrawing them all that often is most of the terminal output.
+SEGMENT_BAR_REFRESH_INTERVAL = 0.5
+
+class ProgressRenderer:
+    """
+    Renders tqdm bars on a background thread.
+    The downloader callbacks only enqueue messages, so tqdm's formatting and its
+    lock never run on the event loop. Every bar is touched by the render thread only.
+    """
+
+    def __init__(self, output_name: str):
+        self.output_name = output_name
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        # Owned by the render thread.
+        self._total: Optional[tqdm] = None
+        self._segments: list = []
+        # Segment ids whose bar currently shows a retry label.
+        self._retrying: set = set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._drain, name="pydm-progress", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    # Downloader callbacks (event loop thread).
+
+    def on_start(self, state: DownloadState):
+        # Snapshot now: by the time the render thread sees this, later flushes may
+        # already have advanced downloaded_bytes and will arrive as their own messages.
+        segments = [(s.id, s.end - s.start + 1, s.downloaded_bytes) for s in state.segments]
+        self._queue.put(('start', state.total_size, state.downloaded_bytes, segments))
+
+    def on_progress(self, segment_id: int, bytes_written: int):
+        self._queue.put(('progress', segment_id, bytes_written))
+
+    def on_retry(self, segment_id: int, attempt: int):
+        self._queue.put(('retry', segment_id, attempt))
+
+    # Render thread.
+
+    def _drain(self):
+        while True:
+            messages = [self._queue.get()]
+            # Take everything else that is already queued, so the shared total bar
+            # gets one update per batch rather than one per flush.
+            while True:
+                try:
+                    messages.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            pending = defaultdict(int)
+            for message in messages:
+                if message is None:
+                    self._apply(pending)
+                    self._close_bars()
+                    return
+                kind = message[0]
+                if kind == 'progress':
+                    pending[message[1]] += message[2]
+                    continue
+                # Anything else must see the progress queued before it.
+                self._apply(pending)
+                pending.clear()
+                if kind == 'start':
+                    self._setup_bars(*message[1:])
+                elif kind == 'retry' and self._segments:
+                    segment_id, attempt = message[1:]
+                    self._segments[segment_id].set_description(f"Seg {segment_id} (retry {attempt})")
+                    self._retrying.add(segment_id)
+            self._apply(pending)
+
+    def _apply(self, pending):
+        if not pending or self._total is None:
+            return
+        for segment_id, n in pending.items():
+            if segment_id in self._retrying:
+                # Progress again means the retry worked; drop the label.
+                self._retrying.discard(segment_id)
+                self._segments[segment_id].set_description(f"Seg {segment_id}")
+            self._segments[segment_id].update(n)
+        self._total.update(sum(pending.values()))
+
+    def _setup_bars(self, total_size: int, initial_total: int, segments: list):
+        # Sent again if the downloader re-plans segments, so drop any old bars first.
+        self._close_bars()
+        # 1. Main Global Bar
+        # downloaded_bytes already covers anything resumed from a previous run.
+        self._total = tqdm(
+            total=total_size,
+            initial=initial_total,
+            unit='B',
+            unit_scale=True,
+            unit_divisor=1024,
+            desc=f"Total: {self.output_name}",
+            position=0,
+            leave=True
+        )
+
+        # 2. Segment Bars
+        # One bar per segment, indexed by segment id (ids are 0..N-1). Position starting from 1.
+        self._segments = [None] * len(segments)
+        for seg_id, seg_size, downloaded in segments:
+            self._segments[seg_id] = tqdm(
+                total=seg_size,
+                initial=downloaded,
+                unit='B',
+                unit_scale=True,
+                unit_divisor=1024,
+                desc=f"Seg {seg_id}",
+                position=seg_id + 1,
+                mininterval=SEGMENT_BAR_REFRESH_INTERVAL,
+                # leave=False but keep 'position' so they overwrite themselves in place.
+                leave=False,
+                bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt}' # Compact format
+            )
+
+    def _close_bars(self):
+        if self._total: self._total.close()
+        for b in self._segments: b.close()
+        self._total = None
+        self._segments = []
+        self._retrying.clear()
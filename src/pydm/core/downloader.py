@@ -1,60 +1,138 @@
 import asyncio
 import os
+import random
+import time
 import aiohttp
 from typing import Optional, Callable
-from .models import DownloadState, Segment, SegmentStatus
-from ..utils.file_ops import pre_allocate_file, write_segment_async
+from .models import DownloadState, Segment, SegmentStatus, SEGMENT_RECORD
+from ..utils.file_ops import pre_allocate_file, open_for_writing, write_at
+from ..utils.uring_writer import IoUringBatchEngine
+from ..utils.bufpool import BufferPool
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Coalesced size handed to the writer.
+FLUSH_BYTES = 256 * 1024
+# Minimum seconds between mid-segment progress saves.
+SAVE_INTERVAL = 1.0
+# Per-segment retries for transient errors, and the cap on the backoff delay in seconds.
+MAX_RETRIES = 5
+MAX_BACKOFF = 30
+# Seconds allowed to establish a connection, and to wait between reads on an open one.
+SOCK_CONNECT_TIMEOUT = 30
+SOCK_READ_TIMEOUT = 60
+
+# HTTP statuses worth retrying; other 4xx responses won't change on a retry.
+_RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class _RangeIgnoredError(RuntimeError):
+    pass
+
+def _noop_progress(segment_id: int, bytes_written: int):
+    pass
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in _RETRYABLE_STATUSES
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
 class Downloader:
-    def __init__(self, url: str, output_file: str, num_segments: int = 8, max_concurrent: int = 4):
+    def __init__(self, url: str, output_file: str, num_segments: int = 8, max_concurrent: int = 4,
+                 debug_state: bool = False, max_retries: int = MAX_RETRIES):
         self.url = url
         self.output_file = output_file
+        # num_segments is only how many byte ranges the file is split into;
+        # max_concurrent is how many of them download at once.
         self.num_segments = num_segments
         self.max_concurrent = max_concurrent
+        # Write the state file as human-readable JSON instead of the compact binary layout.
+        self.debug_state = debug_state
+        # Retries per segment for transient network errors, with exponential backoff.
+        self.max_retries = max_retries
         output_dir = os.path.dirname(output_file) or '.'
         output_name = os.path.basename(output_file)
         self.state_file = os.path.join(output_dir, f".{output_name}.state")
         self.state: Optional[DownloadState] = None
+        self._last_save_ts = 0.0
+        # State file descriptor for in-place segment checkpoints (binary state only).
+        self._state_fd: Optional[int] = None
+        self._records_offset = 0
+        # Set when a server answers a ranged GET with a full 200 response.
+        self._range_ignored = False
         # Callback signature: (segment_id, bytes_written)
-        self._progress_callback: Optional[Callable[[int, int], None]] = None
+        # Defaults to a no-op so the flush path can call it unconditionally.
+        self._progress_callback: Callable[[int, int], None] = _noop_progress
+        # Called once with the final state right before segments start downloading.
+        self._start_callback: Optional[Callable[[DownloadState], None]] = None
+        # Callback signature: (segment_id, attempt)
+        self._retry_callback: Optional[Callable[[int, int], None]] = None
+        # Output file descriptor, open only while segments are downloading.
+        self._fd: Optional[int] = None
+        self._writer: Optional[IoUringBatchEngine] = None
+        # Only max_concurrent segments hold a buffer at once.
+        self._bufpool = BufferPool(item_size=FLUSH_BYTES, max_idle=self.max_concurrent * 2)
 
     def set_progress_callback(self, callback: Callable[[int, int], None]):
         self._progress_callback = callback
 
+    def set_retry_callback(self, callback: Callable[[int, int], None]):
+        self._retry_callback = callback
+
+    def set_start_callback(self, callback: Callable[[DownloadState], None]):
+        self._start_callback = callback
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        # One keep-alive pool for the HEAD and every segment GET. All segments hit the
+        # same host, so the per-host limit is what actually bounds concurrency.
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent,
+            limit_per_host=self.max_concurrent,
+            keepalive_timeout=60,
+            enable_cleanup_closed=True,
+            ttl_dns_cache=300,
+        )
+        # No total deadline: a large segment (or a whole file without range support) may
+        # legitimately take longer than aiohttp's default 5 minutes. Only stalls count.
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=SOCK_CONNECT_TIMEOUT, sock_read=SOCK_READ_TIMEOUT)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
     async def start(self):
+        async with self._create_session() as session:
+            await self._run(session)
+
+    async def _run(self, session: aiohttp.ClientSession):
         # 1. Load or Initialize State
         if os.path.exists(self.state_file):
             logger.info("Found existing state file. Resuming...")
             self._load_state()
+            if not await self._is_resume_valid(session):
+                logger.warning("Remote file changed since the last run. Restarting download.")
+                await self._initialize_new_download(session)
         else:
             logger.info("Starting new download...")
-            await self._initialize_new_download()
+            await self._initialize_new_download(session)
 
         if not self.state:
             raise RuntimeError("Failed to initialize download state.")
 
         # 2. Prepare File
-        if not os.path.exists(self.output_file):
-             # If resuming but output file missing, we arguably should restart or warn.
-             # For simplicity, we assume if state exists, file exists or we recreate it (but segments might be lost).
-             # If completely lost, resetting state is safer.
-             if any(s.status == SegmentStatus.COMPLETED for s in self.state.segments):
-                 logger.warning("Output file missing but state says completed segments exist. Resetting state.")
-                 await self._initialize_new_download() # Re-init
-             else:
-                 pre_allocate_file(self.output_file, self.state.total_size)
-        
-        # Ensure file size is correct
-        current_size = os.path.getsize(self.output_file)
-        if current_size != self.state.total_size:
-             # Basic check.
-             logger.info(f"File size mismatch ({current_size} != {self.state.total_size}). Adjusting...")
-             pre_allocate_file(self.output_file, self.state.total_size) # This truncates/expands
+        # Recorded progress (completed segments or checkpointed mid-segment bytes) is only
+        # valid if the output file still holds it. A missing or wrong-size file means those
+        # bytes are gone, so start over rather than trust the state.
+        has_progress = any(s.downloaded_bytes or s.status == SegmentStatus.COMPLETED for s in self.state.segments)
+        file_ok = os.path.exists(self.output_file) and os.path.getsize(self.output_file) == self.state.total_size
+        if not file_ok:
+            if has_progress:
+                logger.warning("Output file missing or wrong size but state records progress. Resetting state.")
+                await self._initialize_new_download(session) # Re-init
+            else:
+                pre_allocate_file(self.output_file, self.state.total_size)
 
         # 3. Download Loop
+        # The connector already caps open sockets at max_concurrent. The semaphore keeps
+        # segments waiting for a connection from holding a pooled buffer in the meantime,
+        # so memory is bounded by max_concurrent no matter how many segments there are.
         semaphore = asyncio.Semaphore(self.max_concurrent)
         
         pending_segments = [s for s in self.state.segments if s.status != SegmentStatus.COMPLETED]
@@ -62,124 +140,265 @@ class Downloader:
             logger.info("Download already complete.")
             return
 
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                self._download_segment(session, segment, semaphore)
-                for segment in pending_segments
-            ]
-            await asyncio.gather(*tasks)
+        # Single shared descriptor; every segment writes with positional writes.
+        self._fd = open_for_writing(self.output_file)
+        self._writer = IoUringBatchEngine()
+        if not self.debug_state:
+            # Kept open so flushes can checkpoint their segment record in place.
+            self._state_fd = open_for_writing(self.state_file)
+        try:
+            if self._start_callback:
+                self._start_callback(self.state)
+            await self._download_segments(session, semaphore, pending_segments)
+
+            if self._range_ignored:
+                # A 200 carries the whole file, so partial segments can't be trusted. Start over
+                # with one segment covering everything, which a 200 answers correctly.
+                logger.warning("Server ignored Range requests. Restarting as a single segment.")
+                self._range_ignored = False
+                self.state.range_supported = False
+                self.state.segments = self._calculate_segments(self.state.total_size, 1)
+                self._save_state()
+                if self._start_callback:
+                    self._start_callback(self.state)
+                await self._download_segments(session, semaphore, self.state.segments)
+        finally:
+            self._writer.close()
+            self._writer = None
+            os.close(self._fd)
+            self._fd = None
+            if self._state_fd is not None:
+                os.close(self._state_fd)
+                self._state_fd = None
 
         # 4. Cleanup
-        if all(s.status == SegmentStatus.COMPLETED for s in self.state.segments):
+        if self.state.is_complete():
             logger.info("Download completed successfully.")
             if os.path.exists(self.state_file):
                 os.remove(self.state_file)
         else:
             logger.warning("Download finished but not all segments completed.")
 
-    async def _initialize_new_download(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.head(self.url) as response:
-                if response.status >= 400:
-                    raise RuntimeError(f"Failed to fetch metadata: {response.status}")
-                
-                total_size = int(response.headers.get('Content-Length', 0))
-                accept_ranges = response.headers.get('Accept-Ranges', 'none')
-                range_supported = 'bytes' in accept_ranges or accept_ranges == 'bytes'
-
-                if not range_supported:
-                    logger.warning("Server does not support ranges. Fallback to single segment.")
-                    self.num_segments = 1
-
-                if total_size == 0:
-                    # Some servers don't send Content-Length for chunked transfer
-                    # In that case, multi-threaded download is hard/impossible without known size
-                    raise RuntimeError("Cannot determine file size (Content-Length missing).")
-
-                segments = self._calculate_segments(total_size, self.num_segments)
-                self.state = DownloadState(
-                    url=self.url,
-                    output_file=self.output_file,
-                    total_size=total_size,
-                    segments=segments
-                )
-                
-                pre_allocate_file(self.output_file, total_size)
-                self._save_state()
+    async def _initialize_new_download(self, session: aiohttp.ClientSession):
+        async with session.head(self.url) as response:
+            if response.status >= 400:
+                raise RuntimeError(f"Failed to fetch metadata: {response.status}")
+            
+            total_size = int(response.headers.get('Content-Length', 0))
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            accept_ranges = response.headers.get('Accept-Ranges', 'none')
+            range_supported = 'bytes' in (unit.strip().lower() for unit in accept_ranges.split(','))
+
+            if not range_supported:
+                logger.warning("Server does not support ranges. Fallback to single segment.")
+                self.num_segments = 1
+
+            if total_size == 0:
+                # Some servers don't send Content-Length for chunked transfer
+                # In that case, multi-threaded download is hard/impossible without known size
+                raise RuntimeError("Cannot determine file size (Content-Length missing).")
+
+            segments = self._calculate_segments(total_size, self.num_segments)
+            self.state = DownloadState(
+                url=self.url,
+                output_file=self.output_file,
+                total_size=total_size,
+                segments=segments,
+                etag=etag,
+                last_modified=last_modified,
+                range_supported=range_supported
+            )
+            
+            pre_allocate_file(self.output_file, total_size)
+            self._save_state()
+
+    async def _is_resume_valid(self, session: aiohttp.ClientSession) -> bool:
+        # Partial bytes are only reusable if the server still serves the same file.
+        async with session.head(self.url) as response:
+            if response.status >= 400:
+                raise RuntimeError(f"Failed to fetch metadata: {response.status}")
+            total_size = int(response.headers.get('Content-Length', 0))
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        if total_size and total_size != self.state.total_size:
+            return False
+        if self.state.etag and etag and etag != self.state.etag:
+            return False
+        if self.state.last_modified and last_modified and last_modified != self.state.last_modified:
+            return False
+        return True
 
     def _calculate_segments(self, total_size: int, num_segments: int) -> list[Segment]:
-        segments = []
         segment_size = total_size // num_segments
-        for i in range(num_segments):
-            start = i * segment_size
-            # Last segment gets the remainder
-            end = (start + segment_size - 1) if i < num_segments - 1 else total_size - 1
-            segments.append(Segment(id=i, start=start, end=end, status=SegmentStatus.PENDING))
+        segments = [
+            Segment(id=i, start=i * segment_size, end=(i + 1) * segment_size - 1, status=SegmentStatus.PENDING)
+            for i in range(num_segments)
+        ]
+        # Last segment gets the remainder
+        segments[-1].end = total_size - 1
         return segments
 
+    async def _download_segments(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                                 segments: list[Segment]):
+        await asyncio.gather(*(self._download_segment(session, segment, semaphore) for segment in segments))
+
     async def _download_segment(self, session: aiohttp.ClientSession, segment: Segment, semaphore: asyncio.Semaphore):
         async with semaphore:
-            # Check if partially downloaded? 
-            # Logic: If failed/pending, we start from start + downloaded_bytes 
-            # But the requirement says "write it directly to the file... offset...".
-            # If we resume, we should seek to correct place.
-            
-            # Simple resume: If status is FAILED/PENDING, we reset downloaded_bytes to 0 implicitly unless we trust it.
-            #info.md says: "Resume Logic... Only ... for segments PENDING or FAILED"
-            # It also says: "Update state... only when a segment is fully completed".
-            # This implies we DON'T keep partial segment progress in the state file for safety,
-            # OR we do, but we need to verify.
-            # "downloaded_bytes: For partially failed segments, track how much was saved."
-            # If we trust `downloaded_bytes`, we could resume mid-segment.
+            # Resume from start + downloaded_bytes. downloaded_bytes only counts flushed data and
+            # is checkpointed after every flush, so it is safe to trust mid-segment
+            # (_run resets the state if the output file no longer holds it).
             # Header: Range: bytes={current_start}-{end}
-            
-            current_start = segment.start + segment.downloaded_bytes
-            if current_start > segment.end:
+
+            if segment.start + segment.downloaded_bytes > segment.end:
                 segment.status = SegmentStatus.COMPLETED
                 self._save_state()
                 return
 
-            headers = {'Range': f'bytes={current_start}-{segment.end}'}
-            logger.debug(f"Starting segment {segment.id}: {headers}")
-            
+            # Not saved on its own; the first flush's checkpoint records it along with the progress.
             segment.status = SegmentStatus.IN_PROGRESS
-            # (Don't save state on IN_PROGRESS to reduce IO? Or do? info.md says update on completion)
-            
-            try:
-                async with session.get(self.url, headers=headers) as response:
-                    response.raise_for_status()
-                    
-                    async for chunk in response.content.iter_chunked(8192):
-                        # Write chunk
-                        write_offset = segment.start + segment.downloaded_bytes
-                        await write_segment_async(self.output_file, write_offset, chunk)
-                        
-                        chunk_len = len(chunk)
-                        segment.downloaded_bytes += chunk_len
-                        
-                        if self._progress_callback:
-                            self._progress_callback(segment.id, chunk_len)
-                            
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self._fetch_range(session, segment)
                     # Finished segment
                     segment.status = SegmentStatus.COMPLETED
                     self._save_state()
                     logger.debug(f"Segment {segment.id} complete.")
+                    return
+                except _RangeIgnoredError as e:
+                    logger.debug(str(e))
+                    self._range_ignored = True
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries or not _is_retryable(e):
+                        logger.error(f"Error downloading segment {segment.id}: {e!r}")
+                        break
+                    delay = min(2 ** attempt, MAX_BACKOFF) + random.random()
+                    logger.warning(f"Segment {segment.id} failed ({e!r}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                    if self._retry_callback:
+                        self._retry_callback(segment.id, attempt + 1)
+                    await asyncio.sleep(delay)
 
-            except Exception as e:
-                logger.error(f"Error downloading segment {segment.id}: {e}")
-                segment.status = SegmentStatus.FAILED
-                self._save_state()
-                # We do not re-raise to allow other segments to continue? 
-                # Or we let gather handle exceptions? 
-                # Usually better to suppress and retry later or let the whole thing fail gracefully?
-                # For now, just mark FAILED.
+            segment.status = SegmentStatus.FAILED
+            self._save_state()
+            # We do not re-raise to allow other segments to continue.
+
+    async def _fetch_range(self, session: aiohttp.ClientSession, segment: Segment):
+        if not self.state.range_supported:
+            # The server always answers from byte 0, so a retry has to start over with a plain GET.
+            # Without range support there is only one segment: the whole file.
+            if segment.downloaded_bytes:
+                segment.downloaded_bytes = 0
+                if self._start_callback:
+                    self._start_callback(self.state)
+            headers = {}
+        else:
+            # Resumes from whatever is already on disk, so a retry re-downloads nothing that was flushed.
+            headers = {'Range': f'bytes={segment.start + segment.downloaded_bytes}-{segment.end}'}
+        current_start = segment.start + segment.downloaded_bytes
+        logger.debug(f"Starting segment {segment.id}: {headers}")
+
+        async with session.get(self.url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                # Server ignored Range and is sending the file from byte 0. That is only what
+                # we asked for when this segment is the whole file, starting from scratch.
+                if current_start != 0 or segment.end != self.state.total_size - 1:
+                    raise _RangeIgnoredError(
+                        f"Segment {segment.id}: expected 206 for {headers.get('Range')}, got {response.status}"
+                    )
+
+            # Coalesce network chunks into a pooled buffer so the disk sees FLUSH_BYTES-sized writes.
+            buf = self._bufpool.acquire()
+            view = memoryview(buf)
+            pos = 0
+            try:
+                # readany() hands back everything aiohttp has buffered instead of fixed-size
+                # slices; the copy loop below still splits it at FLUSH_BYTES to bound memory.
+                while True:
+                    chunk = await response.content.readany()
+                    if not chunk:
+                        break
+                    chunk_view = memoryview(chunk)
+                    if pos == 0 and len(chunk_view) >= FLUSH_BYTES:
+                        # Already flush-sized: write straight from aiohttp's buffer, skipping the copy.
+                        await self._flush(segment, chunk_view)
+                        continue
+                    while chunk_view:
+                        n = min(len(chunk_view), FLUSH_BYTES - pos)
+                        view[pos:pos + n] = chunk_view[:n]
+                        chunk_view = chunk_view[n:]
+                        pos += n
+                        if pos == FLUSH_BYTES:
+                            await self._flush(segment, view)
+                            pos = 0
+                if pos:
+                    await self._flush(segment, view[:pos])
+            finally:
+                view.release()
+                self._bufpool.release(buf)
+
+        if segment.start + segment.downloaded_bytes <= segment.end:
+            raise aiohttp.ClientPayloadError(
+                f"Segment {segment.id} ended early at byte {segment.start + segment.downloaded_bytes}"
+            )
+
+    async def _flush(self, segment: Segment, data: memoryview):
+        # downloaded_bytes only advances once data is on disk, so it is always safe to resume from.
+        write_offset = segment.start + segment.downloaded_bytes
+        await self._writer.write(self._fd, write_offset, data)
 
-    def _save_state(self):
-        with open(self.state_file, 'w') as f:
-            f.write(self.state.to_json())
+        flushed = len(data)
+        segment.downloaded_bytes += flushed
+
+        self._progress_callback(segment.id, flushed)
+
+        self._checkpoint(segment)
+
+    def _checkpoint(self, segment: Segment):
+        # Overwrite just this segment's fixed-size record. The pwrite is tiny and runs on the
+        # event loop thread, so it cannot interleave with other checkpoints or full saves.
+        if self._state_fd is None:
+            self._save_state(debounce=True)
+            return
+        offset = self._records_offset + segment.id * SEGMENT_RECORD.size
+        write_at(self._state_fd, segment.to_record(), offset)
+
+    def _save_state(self, debounce: bool = False):
+        # Progress saves are debounced; status changes (complete/failed) always go through.
+        now = time.monotonic()
+        if debounce and now - self._last_save_ts < SAVE_INTERVAL:
+            return
+        self._last_save_ts = now
+
+        # Write to a temp file and rename so a crash never leaves a truncated state file.
+        tmp_file = self.state_file + '.tmp'
+        if self.debug_state:
+            data = self.state.to_json_bytes()
+        else:
+            data = self.state.to_bytes()
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, self.state_file)
+        self._records_offset = self.state.records_offset()
+
+        # The rename swapped the inode; point the checkpoint descriptor at the new file.
+        if self._state_fd is not None:
+            os.close(self._state_fd)
+            self._state_fd = open_for_writing(self.state_file)
 
     def _load_state(self):
-        with open(self.state_file, 'r') as f:
-            json_str = f.read()
-            self.state = DownloadState.from_json(json_str)
+        with open(self.state_file, 'rb') as f:
+            data = f.read()
+        # Either layout is accepted, so state files written with debug_state still resume.
+        if DownloadState.is_binary(data):
+            self.state = DownloadState.from_bytes(data)
+            self._records_offset = self.state.records_offset()
+        else:
+            self.state = DownloadState.from_json(data)
+            if not self.debug_state:
+                # Checkpoints patch binary records in place, so convert a JSON file up front.
+                self._save_state()
 
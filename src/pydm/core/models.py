@@ -1,7 +1,13 @@
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Optional
+from typing import List, Optional, Union
 import json
+import struct
+
+try:
+    import orjson
+except ImportError:  # Optional; stdlib json is used otherwise.
+    orjson = None
 
 class SegmentStatus(Enum):
     PENDING = "PENDING"
@@ -9,7 +15,26 @@ class SegmentStatus(Enum):
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
 
-@dataclass
+# Binary state layout (little-endian):
+#   header: magic, version, flags, url_len, output_len, etag_len, last_modified_len, total_size, num_segments
+#   followed by the utf-8 url, output path, etag and last_modified, then one fixed-size record per segment.
+# Records are fixed-size so a single segment can be checkpointed in place (see records_offset).
+STATE_MAGIC = b'PYDM'
+STATE_VERSION = 3
+STATE_HEADER = struct.Struct('<4sBBHHHHQH')
+FLAG_RANGE_SUPPORTED = 0x01
+SEGMENT_RECORD = struct.Struct('<IQQBQ')
+
+# Stable on-disk codes; never reorder.
+_STATUS_TO_CODE = {
+    SegmentStatus.PENDING: 0,
+    SegmentStatus.IN_PROGRESS: 1,
+    SegmentStatus.COMPLETED: 2,
+    SegmentStatus.FAILED: 3,
+}
+_CODE_TO_STATUS = {code: status for status, code in _STATUS_TO_CODE.items()}
+
+@dataclass(slots=True)
 class Segment:
     id: int
     start: int
@@ -17,38 +42,141 @@ class Segment:
     status: SegmentStatus = SegmentStatus.PENDING
     downloaded_bytes: int = 0
 
-    def to_dict(self):
-        data = asdict(self)
-        data['status'] = self.status.value
-        return data
+    def to_record(self) -> bytes:
+        return SEGMENT_RECORD.pack(self.id, self.start, self.end, _STATUS_TO_CODE[self.status], self.downloaded_bytes)
 
     @classmethod
-    def from_dict(cls, data):
-        data['status'] = SegmentStatus(data['status'])
-        return cls(**data)
+    def from_record(cls, buf, offset: int = 0) -> 'Segment':
+        seg_id, start, end, code, downloaded_bytes = SEGMENT_RECORD.unpack_from(buf, offset)
+        return cls(id=seg_id, start=start, end=end, status=_CODE_TO_STATUS[code], downloaded_bytes=downloaded_bytes)
 
-@dataclass
+@dataclass(slots=True)
 class DownloadState:
     url: str
     output_file: str
     total_size: int
     segments: List[Segment]
-    
-    def to_json(self) -> str:
-        return json.dumps({
+    # Validators from the HEAD response, used to reject resuming against a changed file.
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # False once the server is known to ignore Range; the download is then a single segment.
+    range_supported: bool = True
+
+    @property
+    def downloaded_bytes(self) -> int:
+        return sum(s.downloaded_bytes for s in self.segments)
+
+    def is_complete(self) -> bool:
+        return all(s.status is SegmentStatus.COMPLETED for s in self.segments)
+
+    def _to_json_data(self) -> dict:
+        # Segment dicts are built inline; asdict() would recursively deep-copy every field.
+        return {
             'url': self.url,
             'output_file': self.output_file,
             'total_size': self.total_size,
-            'segments': [s.to_dict() for s in self.segments]
-        }, indent=4)
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'range_supported': self.range_supported,
+            'segments': [
+                {
+                    'id': s.id,
+                    'start': s.start,
+                    'end': s.end,
+                    'status': s.status.value,
+                    'downloaded_bytes': s.downloaded_bytes,
+                }
+                for s in self.segments
+            ]
+        }
+
+    def to_json(self) -> str:
+        if orjson is not None:
+            return orjson.dumps(self._to_json_data()).decode('utf-8')
+        return json.dumps(self._to_json_data(), separators=(',', ':'))
+
+    def to_json_bytes(self) -> bytes:
+        """UTF-8 JSON ready for writing; orjson produces this directly without a str round-trip."""
+        if orjson is not None:
+            return orjson.dumps(self._to_json_data())
+        return json.dumps(self._to_json_data(), separators=(',', ':')).encode('utf-8')
 
     @classmethod
-    def from_json(cls, json_str: str) -> 'DownloadState':
-        data = json.loads(json_str)
-        segments = [Segment.from_dict(s) for s in data['segments']]
+    def from_json(cls, json_str: Union[str, bytes]) -> 'DownloadState':
+        data = orjson.loads(json_str) if orjson is not None else json.loads(json_str)
+        segments = [
+            Segment(
+                id=s['id'],
+                start=s['start'],
+                end=s['end'],
+                status=SegmentStatus(s['status']),
+                downloaded_bytes=s['downloaded_bytes'],
+            )
+            for s in data['segments']
+        ]
         return cls(
             url=data['url'],
             output_file=data['output_file'],
             total_size=data['total_size'],
-            segments=segments
+            segments=segments,
+            etag=data.get('etag'),
+            last_modified=data.get('last_modified'),
+            range_supported=data.get('range_supported', True)
         )
+
+    def _encoded_strings(self) -> List[bytes]:
+        return [
+            self.url.encode('utf-8'),
+            self.output_file.encode('utf-8'),
+            (self.etag or '').encode('utf-8'),
+            (self.last_modified or '').encode('utf-8'),
+        ]
+
+    def records_offset(self) -> int:
+        """Byte offset of the first segment record in the binary layout."""
+        return STATE_HEADER.size + sum(len(b) for b in self._encoded_strings())
+
+    def to_bytes(self) -> bytes:
+        strings = self._encoded_strings()
+        flags = FLAG_RANGE_SUPPORTED if self.range_supported else 0
+        header = STATE_HEADER.pack(
+            STATE_MAGIC, STATE_VERSION, flags, *(len(b) for b in strings), self.total_size, len(self.segments)
+        )
+        return b''.join([header] + strings + [s.to_record() for s in self.segments])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DownloadState':
+        magic, version, flags, url_len, output_len, etag_len, last_modified_len, total_size, num_segments = \
+            STATE_HEADER.unpack_from(data, 0)
+        if magic != STATE_MAGIC:
+            raise ValueError("Not a PyDM binary state file.")
+        if version != STATE_VERSION:
+            raise ValueError(f"Unsupported state file version: {version}")
+
+        offset = STATE_HEADER.size
+        url = data[offset:offset + url_len].decode('utf-8')
+        offset += url_len
+        output_file = data[offset:offset + output_len].decode('utf-8')
+        offset += output_len
+        etag = data[offset:offset + etag_len].decode('utf-8') or None
+        offset += etag_len
+        last_modified = data[offset:offset + last_modified_len].decode('utf-8') or None
+        offset += last_modified_len
+
+        segments = []
+        for _ in range(num_segments):
+            segments.append(Segment.from_record(data, offset))
+            offset += SEGMENT_RECORD.size
+        return cls(
+            url=url,
+            output_file=output_file,
+            total_size=total_size,
+            segments=segments,
+            etag=etag,
+            last_modified=last_modified,
+            range_supported=bool(flags & FLAG_RANGE_SUPPORTED)
+        )
+
+    @staticmethod
+    def is_binary(data: bytes) -> bool:
+        return data[:len(STATE_MAGIC)] == STATE_MAGIC
@@ -0,0 +1,25 @@
+from collections import deque
+
+class BufferPool:
+    """
+    Hands out fixed-size bytearrays and keeps up to max_idle of them for reuse,
+    so segments do not allocate a fresh coalescing buffer each time they run.
+    Not thread-safe; it is meant to be used from the event loop only.
+    """
+
+    def __init__(self, item_size: int, max_idle: int):
+        self.item_size = item_size
+        self.max_idle = max_idle
+        self._idle: deque[bytearray] = deque()
+
+    def acquire(self) -> bytearray:
+        if self._idle:
+            return self._idle.pop()
+        return bytearray(self.item_size)
+
+    def release(self, buf: bytearray):
+        if len(buf) == self.item_size and len(self._idle) < self.max_idle:
+            self._idle.append(buf)
+
+    def __len__(self) -> int:
+        return len(self._idle)
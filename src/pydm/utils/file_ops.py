@@ -1,11 +1,28 @@
+import errno
 import os
-import aiofiles
+import threading
+
+# errnos meaning posix_fallocate isn't available for this file; anything else (e.g. ENOSPC) is real.
+_FALLOCATE_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL}
+
+# Serialises seek+write on platforms without os.pwrite (e.g. Windows).
+_seek_lock = threading.Lock()
 
 def pre_allocate_file(filename: str, size: int):
     """
     Creates an empty file of the specified size.
+    Blocks are reserved up front with posix_fallocate where the OS and filesystem
+    support it, so downloads don't pay for filling holes in a sparse file and
+    running out of disk space fails immediately. Otherwise falls back to truncate.
     """
     with open(filename, 'wb') as f:
+        if size > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError as e:
+                if e.errno not in _FALLOCATE_UNSUPPORTED:
+                    raise
         f.truncate(size)
 
 def write_segment_sync(filename: str, offset: int, data: bytes):
@@ -20,10 +37,26 @@ def write_segment_sync(filename: str, offset: int, data: bytes):
         f.seek(offset)
         f.write(data)
 
-async def write_segment_async(filename: str, offset: int, data: bytes):
+def open_for_writing(filename: str) -> int:
+    """
+    Opens an existing file for positional writes and returns the raw descriptor.
+    """
+    return os.open(filename, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+
+def write_at(fd: int, data: bytes, offset: int):
     """
-    Writes data using aiofiles (which runs in a thread pool executor usually).
+    Writes all of data to fd at offset without moving a shared file position.
+    Uses os.pwrite where available; it is blocking, so call it via an executor.
     """
-    async with aiofiles.open(filename, 'r+b') as f:
-        await f.seek(offset)
-        await f.write(data)
+    view = memoryview(data)
+    if hasattr(os, 'pwrite'):
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
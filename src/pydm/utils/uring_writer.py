@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from .file_ops import write_at
+
+try:
+    import liburing
+except ImportError:  # Optional, Linux only.
+    liburing = None
+
+logger = logging.getLogger(__name__)
+
+@dataclass(slots=True)
+class UringOp:
+    fd: int
+    offset: int
+    data: bytes
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+
+class IoUringBatchEngine:
+    """
+    Batches positional writes through io_uring on a daemon thread.
+    Every write queued while the ring is busy goes out in one io_uring_submit().
+    Without liburing, writes fall back to os.pwrite via the default executor.
+    """
+
+    def __init__(self, entries: int = 64):
+        self.entries = entries
+        self._queue: "queue.Queue[Optional[UringOp]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._ring = None
+        # Set once the worker hits an unrecoverable error; later writes fail immediately.
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+        if liburing is not None:
+            try:
+                ring = liburing.io_uring()
+                liburing.io_uring_queue_init(entries, ring, 0)
+                self._ring = ring
+            except Exception as e:
+                logger.warning(f"io_uring unavailable, using pwrite: {e!r}")
+        if self._ring is not None:
+            self._thread = threading.Thread(target=self._worker, name="pydm-uring", daemon=True)
+            self._thread.start()
+
+    @property
+    def uses_uring(self) -> bool:
+        return self._ring is not None
+
+    async def write(self, fd: int, offset: int, data: bytes) -> int:
+        loop = asyncio.get_running_loop()
+        if self._ring is None:
+            await loop.run_in_executor(None, write_at, fd, data, offset)
+            return len(data)
+        future = loop.create_future()
+        # Checked under the lock so nothing is queued after the worker has given up and drained.
+        with self._lock:
+            if self._error is not None:
+                raise RuntimeError("io_uring writer has stopped") from self._error
+            self._queue.put(UringOp(fd, offset, data, future, loop))
+        return await future
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._ring is not None:
+            liburing.io_uring_queue_exit(self._ring)
+            self._ring = None
+
+    def _worker(self):
+        batch = []
+        try:
+            cqe = liburing.io_uring_cqe()
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._run_batch(batch, cqe)
+        except Exception as e:
+            # The ring's state is unknown now; fail everything rather than leave callers waiting.
+            logger.error(f"io_uring writer failed: {e!r}")
+            self._fail_queued(e)
+            for op in batch:
+                op.loop.call_soon_threadsafe(_set_exception, op.future, e)
+
+    def _next_batch(self) -> Optional[list]:
+        # Block for the first op, then drain whatever else is queued into the same batch.
+        op = self._queue.get()
+        if op is None:
+            return None
+        batch = [op]
+        while len(batch) < self.entries:
+            try:
+                op = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if op is None:
+                self._queue.put(None)
+                break
+            batch.append(op)
+        return batch
+
+    def _run_batch(self, batch: list, cqe):
+        ring = self._ring
+        for i, op in enumerate(batch):
+            sqe = liburing.io_uring_get_sqe(ring)
+            if sqe is None:
+                raise RuntimeError("io_uring submission queue is full")
+            liburing.io_uring_prep_write(sqe, op.fd, op.data, len(op.data), op.offset)
+            # liburing rejects user_data 0, so tag ops with their 1-based batch index.
+            sqe.user_data = i + 1
+        liburing.io_uring_submit(ring)
+
+        for _ in batch:
+            liburing.io_uring_wait_cqe(ring, cqe)
+            op = batch[cqe.user_data - 1]
+            res = cqe.res
+            liburing.io_uring_cqe_seen(ring, cqe)
+            self._complete(op, res)
+
+    def _fail_queued(self, error: Exception):
+        with self._lock:
+            self._error = error
+            while True:
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if op is not None:
+                    op.loop.call_soon_threadsafe(_set_exception, op.future, error)
+
+    def _complete(self, op: UringOp, res: int):
+        if res < 0:
+            error = OSError(-res, f"io_uring write failed at offset {op.offset}")
+            op.loop.call_soon_threadsafe(_set_exception, op.future, error)
+            return
+        if res < len(op.data):
+            # Short write: finish the remainder synchronously on this thread.
+            try:
+                write_at(op.fd, memoryview(op.data)[res:], op.offset + res)
+            except OSError as e:
+                op.loop.call_soon_threadsafe(_set_exception, op.future, e)
+                return
+        op.loop.call_soon_threadsafe(_set_result, op.future, len(op.data))
+
+def _set_result(future: asyncio.Future, result: int):
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception(future: asyncio.Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
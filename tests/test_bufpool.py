@@ -0,0 +1,20 @@
+from pydm.utils.bufpool import BufferPool
+
+def test_acquire_reuses_released_buffer():
+    pool = BufferPool(item_size=16, max_idle=2)
+    buf = pool.acquire()
+    assert len(buf) == 16
+    pool.release(buf)
+    assert pool.acquire() is buf
+
+def test_release_respects_max_idle():
+    pool = BufferPool(item_size=16, max_idle=1)
+    a, b = pool.acquire(), pool.acquire()
+    pool.release(a)
+    pool.release(b)
+    assert len(pool) == 1
+
+def test_release_ignores_wrong_size():
+    pool = BufferPool(item_size=16, max_idle=2)
+    pool.release(bytearray(8))
+    assert len(pool) == 0
@@ -1,8 +1,10 @@
+import os
 import pytest
 import asyncio
 from unittest.mock import MagicMock, AsyncMock, patch
 from pydm.core.downloader import Downloader
 from pydm.core.models import SegmentStatus
+from pydm.core.downloader import FLUSH_BYTES
 
 @pytest.mark.asyncio
 async def test_calculate_segments():
@@ -31,31 +33,375 @@ async def test_calculate_segments_uneven():
 @pytest.mark.asyncio
 async def test_init_new_download_mocks():
     # Mock aiohttp session
-    with patch('aiohttp.ClientSession') as MockSession:
-        session_instance = MockSession.return_value
-        session_instance.__aenter__.return_value = session_instance
-        
-        # Mock HEAD response
-        mock_response = AsyncMock()
-        mock_response.status = 200
-        mock_response.headers = {
-            'Content-Length': '1000',
-            'Accept-Ranges': 'bytes'
-        }
-        mock_response.__aenter__.return_value = mock_response
-        
-        session_instance.head.return_value = mock_response
-
-        # Mock file ops
-        with patch('pydm.core.downloader.pre_allocate_file') as mock_alloc, \
-             patch('pydm.core.downloader.Downloader._save_state') as mock_save:
-            
-            downloader = Downloader("http://example.com/foo.zip", "foo.zip")
-            await downloader._initialize_new_download()
-            
-            assert downloader.state is not None
-            assert downloader.state.total_size == 1000
-            assert len(downloader.state.segments) == 8 # default
-            mock_alloc.assert_called_once_with("foo.zip", 1000)
-            mock_save.assert_called()
+    session = MagicMock()
 
+    # Mock HEAD response
+    mock_response = AsyncMock()
+    mock_response.status = 200
+    mock_response.headers = {
+        'Content-Length': '1000',
+        'Accept-Ranges': 'bytes'
+    }
+    mock_response.__aenter__.return_value = mock_response
+
+    session.head.return_value = mock_response
+
+    # Mock file ops
+    with patch('pydm.core.downloader.pre_allocate_file') as mock_alloc, \
+         patch('pydm.core.downloader.Downloader._save_state') as mock_save:
+
+        downloader = Downloader("http://example.com/foo.zip", "foo.zip")
+        await downloader._initialize_new_download(session)
+
+        assert downloader.state is not None
+        assert downloader.state.total_size == 1000
+        assert len(downloader.state.segments) == 8 # default
+        session.head.assert_called_once_with("http://example.com/foo.zip")
+        mock_alloc.assert_called_once_with("foo.zip", 1000)
+        mock_save.assert_called()
+
+@pytest.mark.asyncio
+async def test_create_session_connector_limits():
+    downloader = Downloader("http://example.com/foo.zip", "foo.zip", max_concurrent=6)
+    async with downloader._create_session() as session:
+        assert session.connector.limit == 6
+        assert session.connector.limit_per_host == 6
+        assert session.timeout.total is None
+        assert session.timeout.sock_read == 60
+
+def _make_range_app(payload: bytes, etag: str = '"v1"', ranges: list = None, fail_statuses: list = None,
+                    ignore_range: bool = False, accept_ranges: bool = True, drop_after: list = None):
+    from aiohttp import web
+
+    async def handler(request):
+        headers = {'Content-Length': str(len(payload)), 'ETag': etag}
+        if accept_ranges:
+            headers['Accept-Ranges'] = 'bytes'
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+        range_header = request.headers.get('Range')
+        if ranges is not None:
+            ranges.append(range_header)
+        if fail_statuses:
+            return web.Response(status=fail_statuses.pop(0))
+        if drop_after:
+            # Send part of the body, then cut the connection mid-stream.
+            response = web.StreamResponse(headers=headers)
+            await response.prepare(request)
+            await response.write(payload[:drop_after.pop(0)])
+            request.transport.close()
+            return response
+        if not range_header or ignore_range:
+            return web.Response(body=payload, headers=headers)
+        start, end = range_header.split('=')[1].split('-')
+        body = payload[int(start):int(end) + 1]
+        return web.Response(status=206, body=body, headers={'Accept-Ranges': 'bytes'})
+
+    app = web.Application()
+    app.router.add_route('*', '/file.bin', handler)
+    return app
+
+@pytest.mark.asyncio
+async def test_download_end_to_end(tmp_path):
+    from aiohttp.test_utils import TestServer
+
+    payload = bytes(range(256)) * 1000
+    async with TestServer(_make_range_app(payload)) as server:
+        output = tmp_path / "file.bin"
+        downloader = Downloader(str(server.make_url('/file.bin')), str(output), num_segments=5, max_concurrent=3)
+        received = []
+        started = []
+        downloader.set_start_callback(lambda state: started.append((state.total_size, len(received))))
+        downloader.set_progress_callback(lambda sid, n: received.append(n))
+        await downloader.start()
+
+    assert output.read_bytes() == payload
+    assert started == [(len(payload), 0)]
+    assert sum(received) == len(payload)
+    assert not (tmp_path / ".file.bin.state").exists()
+
+@pytest.mark.asyncio
+async def test_download_coalesces_writes(tmp_path):
+    from aiohttp.test_utils import TestServer
+    from pydm.core.downloader import FLUSH_BYTES
+
+    payload = os.urandom(FLUSH_BYTES * 2 + 1000)
+    async with TestServer(_make_range_app(payload)) as server:
+        output = tmp_path / "file.bin"
+        downloader = Downloader(str(server.make_url('/file.bin')), str(output), num_segments=1)
+        received = []
+        downloader.set_progress_callback(lambda sid, n: received.append(n))
+        await downloader.start()
+
+    assert output.read_bytes() == payload
+    assert received == [FLUSH_BYTES, FLUSH_BYTES, 1000]
+
+def test_save_state_is_atomic_and_debounced(tmp_path):
+    from pydm.core.models import DownloadState
+
+    output = tmp_path / "foo.zip"
+    downloader = Downloader("http://example.com/foo.zip", str(output), num_segments=2)
+    segments = downloader._calculate_segments(100, 2)
+    downloader.state = DownloadState(url=downloader.url, output_file=str(output), total_size=100, segments=segments)
+
+    downloader._save_state()
+    state_path = tmp_path / ".foo.zip.state"
+    assert DownloadState.from_bytes(state_path.read_bytes()).total_size == 100
+    assert not (tmp_path / ".foo.zip.state.tmp").exists()
+
+    segments[0].downloaded_bytes = 10
+    downloader._save_state(debounce=True)
+    assert DownloadState.from_bytes(state_path.read_bytes()).segments[0].downloaded_bytes == 0
+
+    downloader._save_state()
+    assert DownloadState.from_bytes(state_path.read_bytes()).segments[0].downloaded_bytes == 10
+
+def test_load_state_accepts_json_and_binary(tmp_path):
+    from pydm.core.models import DownloadState
+
+    output = tmp_path / "foo.zip"
+    for debug_state in (True, False):
+        downloader = Downloader("http://example.com/foo.zip", str(output), debug_state=debug_state)
+        segments = downloader._calculate_segments(1000, 4)
+        segments[2].status = SegmentStatus.COMPLETED
+        segments[3].downloaded_bytes = 7
+        downloader.state = DownloadState(url=downloader.url, output_file=str(output), total_size=1000, segments=segments)
+        downloader._save_state()
+
+        reloaded = Downloader("http://example.com/foo.zip", str(output))
+        reloaded._load_state()
+        assert reloaded.state == downloader.state
+
+def test_checkpoint_updates_segment_record_in_place(tmp_path):
+    from pydm.core.models import DownloadState
+    from pydm.utils.file_ops import open_for_writing
+
+    output = tmp_path / "foo.zip"
+    downloader = Downloader("http://example.com/foo.zip", str(output), num_segments=3)
+    segments = downloader._calculate_segments(300, 3)
+    downloader.state = DownloadState(url=downloader.url, output_file=str(output), total_size=300,
+                                     segments=segments, etag='"abc"')
+    downloader._save_state()
+
+    downloader._state_fd = open_for_writing(downloader.state_file)
+    try:
+        segments[1].downloaded_bytes = 42
+        segments[1].status = SegmentStatus.IN_PROGRESS
+        downloader._checkpoint(segments[1])
+    finally:
+        os.close(downloader._state_fd)
+
+    reloaded = DownloadState.from_bytes((tmp_path / ".foo.zip.state").read_bytes())
+    assert reloaded == downloader.state
+
+async def _write_partial_state(tmp_path, url, payload, etag):
+    from pydm.core.models import DownloadState
+
+    output = tmp_path / "file.bin"
+    downloader = Downloader(url, str(output), num_segments=2)
+    segments = downloader._calculate_segments(len(payload), 2)
+    segments[0].downloaded_bytes = 100
+    downloader.state = DownloadState(url=url, output_file=str(output), total_size=len(payload),
+                                     segments=segments, etag=etag)
+    output.write_bytes(payload[:100] + b"\0" * (len(payload) - 100))
+    downloader._save_state()
+    return output
+
+@pytest.mark.asyncio
+async def test_resume_continues_mid_segment(tmp_path):
+    from aiohttp.test_utils import TestServer
+
+    payload = os.urandom(1000)
+    ranges = []
+    async with TestServer(_make_range_app(payload, ranges=ranges)) as server:
+        url = str(server.make_url('/file.bin'))
+        output = await _write_partial_state(tmp_path, url, payload, '"v1"')
+        await Downloader(url, str(output), num_segments=2).start()
+
+    assert output.read_bytes() == payload
+    assert sorted(ranges) == ['bytes=100-499', 'bytes=500-999']
+
+@pytest.mark.asyncio
+async def test_resume_restarts_when_etag_changes(tmp_path):
+    from aiohttp.test_utils import TestServer
+
+    payload = os.urandom(1000)
+    ranges = []
+    async with TestServer(_make_range_app(payload, etag='"v2"', ranges=ranges)) as server:
+        url = str(server.make_url('/file.bin'))
+        output = await _write_partial_state(tmp_path, url, b"x" * 1000, '"v1"')
+        await Downloader(url, str(output), num_segments=2).start()
+
+    assert output.read_bytes() == payload
+    assert sorted(ranges) == ['bytes=0-499', 'bytes=500-999']
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    from types import SimpleNamespace
+    import pydm.core.downloader as downloader_module
+
+    monkeypatch.setattr(downloader_module, 'MAX_BACKOFF', 0)
+    monkeypatch.setattr(downloader_module, 'random', SimpleNamespace(random=lambda: 0.0))
+
+@pytest.mark.asyncio
+async def test_segment_retries_transient_errors(tmp_path, no_backoff):
+    from aiohttp.test_utils import TestServer
+
+    payload = os.urandom(1000)
+    async with TestServer(_make_range_app(payload, fail_statuses=[503, 502])) as server:
+        output = tmp_path / "file.bin"
+        downloader = Downloader(str(server.make_url('/file.bin')), str(output), num_segments=1)
+        retries = []
+        downloader.set_retry_callback(lambda sid, attempt: retries.append((sid, attempt)))
+        await downloader.start()
+
+    assert output.read_bytes() == payload
+    assert retries == [(0, 1), (0, 2)]
+
+@pytest.mark.asyncio
+async def test_segment_fails_without_retry_on_client_error(tmp_path, no_backoff):
+    from aiohttp.test_utils import TestServer
+
+    payload = os.urandom(1000)
+    ranges = []
+    async with TestServer(_make_range_app(payload, ranges=ranges, fail_statuses=[404])) as server:
+        output = tmp_path / "file.bin"
+        downloader = Downloader(str(server.make_url('/file.bin')), str(output), num_segments=1)
+        await downloader.start()
+
+    assert len(ranges) == 1
+    assert downloader.state.segments[0].status == SegmentStatus.FAILED
+    assert (tmp_path / ".file.bin.state").exists()
+
+@pytest.mark.asyncio
+async def test_fetch_range_writes_large_reads_without_copy(tmp_path):
+    from pydm.core.downloader import FLUSH_BYTES
+    from pydm.core.models import DownloadState
+    from pydm.utils.file_ops import open_for_writing, pre_allocate_file
+    from pydm.utils.uring_writer import IoUringBatchEngine
+
+    payload = os.urandom(FLUSH_BYTES * 2 + 10)
+    output = tmp_path / "file.bin"
+    pre_allocate_file(str(output), len(payload))
+
+    response = AsyncMock()
+    response.raise_for_status = MagicMock()
+    response.content.readany.side_effect = [payload, b""]
+    response.__aenter__.return_value = response
+    session = MagicMock()
+    session.get.return_value = response
+
+    downloader = Downloader("http://example.com/file.bin", str(output), num_segments=1, debug_state=True)
+    segment = downloader._calculate_segments(len(payload), 1)[0]
+    downloader.state = DownloadState(url=downloader.url, output_file=str(output), total_size=len(payload), segments=[segment])
+    received = []
+    downloader.set_progress_callback(lambda sid, n: received.append(n))
+
+    downloader._fd = open_for_writing(str(output))
+    downloader._writer = IoUringBatchEngine()
+    try:
+        await downloader._fetch_range(session, segment)
+    finally:
+        downloader._writer.close()
+        os.close(downloader._fd)
+
+    assert output.read_bytes() == payload
+    assert received == [len(payload)]
+
+@pytest.mark.asyncio
+async def test_falls_back_to_single_segment_when_range_ignored(tmp_path):
+    from aiohttp.test_utils import TestServer
+
+    payload = os.urandom(5000)
+    ranges = []
+    async with TestServer(_make_range_app(payload, ranges=ranges, ignore_range=True)) as server:
+        output = tmp_path / "file.bin"
+        downloader = Downloader(str(server.make_url('/file.bin')), str(output), num_segments=4)
+        started = []
+        downloader.set_start_callback(lambda state: started.append(len(state.segments)))
+        await downloader.start()
+
+    assert output.read_bytes() == payload
+    assert started == [4, 1]
+    assert ranges[-1] is None
+    assert downloader.state.range_supported is False
+
+@pytest.mark.asyncio
+async def test_resume_from_json_state_converts_to_binary(tmp_path):
+    from aiohttp.test_utils import TestServer
+    from pydm.core.models import DownloadState
+
+    payload = os.urandom(FLUSH_BYTES * 3)
+    async with TestServer(_make_range_app(payload)) as server:
+        url = str(server.make_url('/file.bin'))
+        output = tmp_path / "file.bin"
+        state_path = tmp_path / ".file.bin.state"
+
+        writer = Downloader(url, str(output), num_segments=1, debug_state=True)
+        segments = writer._calculate_segments(len(payload), 1)
+        writer.state = DownloadState(url=url, output_file=str(output), total_size=len(payload),
+                                     segments=segments, etag='"v1"')
+        output.write_bytes(b"\0" * len(payload))
+        writer._save_state()
+        assert not DownloadState.is_binary(state_path.read_bytes())
+
+        # Abort on the second flush, as if interrupted: the first flush has been checkpointed
+        # in place and no full save happens afterwards.
+        downloader = Downloader(url, str(output), num_segments=1)
+        flushes = []
+        def interrupt(segment_id, bytes_written):
+            flushes.append(bytes_written)
+            if len(flushes) == 2:
+                raise asyncio.CancelledError
+        downloader.set_progress_callback(interrupt)
+        with pytest.raises(asyncio.CancelledError):
+            await downloader.start()
+
+        reloaded = Downloader(url, str(output), num_segments=1)
+        reloaded._load_state()
+        assert DownloadState.is_binary(state_path.read_bytes())
+        assert reloaded.state.segments[0].downloaded_bytes == FLUSH_BYTES
+
+        await reloaded.start()
+
+    assert output.read_bytes() == payload
+
+@pytest.mark.asyncio
+async def test_retry_restarts_whole_file_without_range_support(tmp_path, no_backoff):
+    from aiohttp.test_utils import TestServer
+
+    payload = os.urandom(FLUSH_BYTES * 3)
+    ranges = []
+    drops = [FLUSH_BYTES * 2, FLUSH_BYTES + 10]
+    app = _make_range_app(payload, ranges=ranges, accept_ranges=False, drop_after=drops)
+    async with TestServer(app) as server:
+        output = tmp_path / "file.bin"
+        downloader = Downloader(str(server.make_url('/file.bin')), str(output), num_segments=4)
+        started = []
+        downloader.set_start_callback(lambda state: started.append(state.downloaded_bytes))
+        await downloader.start()
+
+    assert output.read_bytes() == payload
+    assert ranges == [None, None, None]
+    assert downloader.state.segments[0].status == SegmentStatus.COMPLETED
+    # Bars are rebuilt from zero each time partial progress is discarded.
+    assert started == [0, 0, 0]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("damage", ["delete", "truncate"])
+async def test_resume_resets_checkpointed_progress_when_output_damaged(tmp_path, damage):
+    from aiohttp.test_utils import TestServer
+
+    payload = os.urandom(1000)
+    ranges = []
+    async with TestServer(_make_range_app(payload, ranges=ranges)) as server:
+        url = str(server.make_url('/file.bin'))
+        output = await _write_partial_state(tmp_path, url, payload, '"v1"')
+        if damage == "delete":
+            output.unlink()
+        else:
+            output.write_bytes(payload[:100])
+        await Downloader(url, str(output), num_segments=2).start()
+
+    assert output.read_bytes() == payload
+    assert sorted(ranges) == ['bytes=0-499', 'bytes=500-999']
@@ -0,0 +1,36 @@
+import errno
+import os
+import pytest
+from pydm.utils.file_ops import pre_allocate_file, write_at
+
+def test_pre_allocate_file_sets_size(tmp_path):
+    path = tmp_path / "out.bin"
+    pre_allocate_file(str(path), 4096)
+    assert path.stat().st_size == 4096
+
+def test_pre_allocate_file_falls_back_to_truncate(tmp_path, monkeypatch):
+    def unsupported(fd, offset, size):
+        raise OSError(errno.EOPNOTSUPP, "not supported")
+
+    monkeypatch.setattr(os, 'posix_fallocate', unsupported, raising=False)
+    path = tmp_path / "out.bin"
+    pre_allocate_file(str(path), 1234)
+    assert path.stat().st_size == 1234
+
+def test_pre_allocate_file_raises_on_real_errors(tmp_path, monkeypatch):
+    def no_space(fd, offset, size):
+        raise OSError(errno.ENOSPC, "no space")
+
+    monkeypatch.setattr(os, 'posix_fallocate', no_space, raising=False)
+    with pytest.raises(OSError):
+        pre_allocate_file(str(tmp_path / "out.bin"), 1234)
+
+def test_write_at_writes_at_offset(tmp_path):
+    path = tmp_path / "out.bin"
+    pre_allocate_file(str(path), 8)
+    fd = os.open(path, os.O_RDWR)
+    try:
+        write_at(fd, b"xy", 3)
+    finally:
+        os.close(fd)
+    assert path.read_bytes() == b"\0\0\0xy\0\0\0"
@@ -0,0 +1,46 @@
+import json
+from pydm.core import models
+from pydm.core.models import DownloadState, Segment, SegmentStatus
+
+def _state():
+    return DownloadState(
+        url="http://example.com/foo.zip",
+        output_file="foo.zip",
+        total_size=100,
+        segments=[
+            Segment(id=0, start=0, end=49, status=SegmentStatus.COMPLETED, downloaded_bytes=50),
+            Segment(id=1, start=50, end=99, status=SegmentStatus.IN_PROGRESS, downloaded_bytes=7),
+        ],
+        etag='"v1"',
+    )
+
+def test_json_round_trip():
+    state = _state()
+    assert DownloadState.from_json(state.to_json()) == state
+
+def test_json_bytes_round_trip():
+    state = _state()
+    data = state.to_json_bytes()
+    assert isinstance(data, bytes)
+    assert DownloadState.from_json(data) == state
+
+def test_json_is_compact_with_stdlib(monkeypatch):
+    monkeypatch.setattr(models, 'orjson', None)
+    text = _state().to_json()
+    assert '\n' not in text and ': ' not in text
+    assert json.loads(text)['segments'][1]['status'] == "IN_PROGRESS"
+    assert DownloadState.from_json(text) == _state()
+
+def test_binary_round_trip():
+    state = _state()
+    data = state.to_bytes()
+    assert DownloadState.is_binary(data)
+    assert DownloadState.from_bytes(data) == state
+    assert len(data) == state.records_offset() + 2 * models.SEGMENT_RECORD.size
+
+def test_progress_helpers():
+    state = _state()
+    assert state.downloaded_bytes == 57
+    assert not state.is_complete()
+    state.segments[1].status = SegmentStatus.COMPLETED
+    assert state.is_complete()
@@ -0,0 +1,47 @@
+from pydm.cli import progress
+from pydm.cli.progress import ProgressRenderer
+from pydm.core.models import DownloadState, Segment
+
+class FakeBar:
+    instances = []
+
+    def __init__(self, total, initial=0, desc='', **kwargs):
+        self.total, self.n, self.desc, self.closed = total, initial, desc, False
+        FakeBar.instances.append(self)
+
+    def update(self, n):
+        self.n += n
+
+    def set_description(self, desc):
+        self.desc = desc
+
+    def close(self):
+        self.closed = True
+
+def test_renderer_applies_queued_updates(monkeypatch):
+    FakeBar.instances = []
+    monkeypatch.setattr(progress, 'tqdm', FakeBar)
+    state = DownloadState(
+        url="http://example.com/foo.zip",
+        output_file="foo.zip",
+        total_size=100,
+        segments=[Segment(id=0, start=0, end=49, downloaded_bytes=10), Segment(id=1, start=50, end=99)],
+    )
+
+    renderer = ProgressRenderer("foo.zip")
+    renderer.start()
+    renderer.on_start(state)
+    renderer.on_progress(0, 5)
+    renderer.on_progress(1, 7)
+    renderer.on_retry(1, 2)
+    renderer.on_progress(1, 3)
+    renderer.on_retry(0, 1)
+    renderer.stop()
+
+    total, seg0, seg1 = FakeBar.instances
+    assert (total.total, total.n) == (100, 25)
+    assert seg0.n == 15 and seg1.n == 10
+    # The label clears once the retried segment makes progress again.
+    assert seg1.desc == "Seg 1"
+    assert seg0.desc == "Seg 0 (retry 1)"
+    assert all(b.closed for b in FakeBar.instances)
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import pytest
+from pydm.utils import uring_writer
+from pydm.utils.uring_writer import IoUringBatchEngine
+
+@pytest.mark.asyncio
+async def test_fallback_write_without_liburing(tmp_path, monkeypatch):
+    monkeypatch.setattr(uring_writer, 'liburing', None)
+    path = tmp_path / "out.bin"
+    path.write_bytes(b"\0" * 10)
+
+    fd = os.open(path, os.O_RDWR)
+    engine = IoUringBatchEngine()
+    try:
+        assert not engine.uses_uring
+        assert await engine.write(fd, 4, b"abc") == 3
+    finally:
+        engine.close()
+        os.close(fd)
+
+    assert path.read_bytes() == b"\0" * 4 + b"abc" + b"\0" * 3
+
+class _Obj:
+    pass
+
+class _Sqe:
+    # Mirrors liburing: user_data 0 is reserved and rejected.
+    @property
+    def user_data(self):
+        return self._user_data
+
+    @user_data.setter
+    def user_data(self, value):
+        if value == 0:
+            raise ValueError("io_uring_sqe.user_data can not be 0")
+        self._user_data = value
+
+class StubLiburing:
+    """Just enough of liburing's API to drive the worker; submit performs writes with pwrite."""
+
+    def __init__(self, fail_submit=False):
+        self.fail_submit = fail_submit
+        self.submits = []
+        self._pending = []
+        self._completions = []
+
+    def io_uring(self):
+        return _Obj()
+
+    def io_uring_queue_init(self, entries, ring, flags):
+        pass
+
+    def io_uring_queue_exit(self, ring):
+        pass
+
+    def io_uring_cqe(self):
+        return _Obj()
+
+    def io_uring_get_sqe(self, ring):
+        sqe = _Sqe()
+        self._pending.append(sqe)
+        return sqe
+
+    def io_uring_prep_write(self, sqe, fd, buf, nbytes, offset):
+        sqe.args = (fd, bytes(buf[:nbytes]), offset)
+
+    def io_uring_submit(self, ring):
+        if self.fail_submit:
+            raise OSError(5, "submit failed")
+        self.submits.append(len(self._pending))
+        for sqe in self._pending:
+            fd, data, offset = sqe.args
+            self._completions.append((sqe.user_data, os.pwrite(fd, data, offset)))
+        self._pending = []
+
+    def io_uring_wait_cqe(self, ring, cqe):
+        cqe.user_data, cqe.res = self._completions.pop(0)
+
+    def io_uring_cqe_seen(self, ring, cqe):
+        pass
+
+def _open(tmp_path):
+    path = tmp_path / "out.bin"
+    path.write_bytes(b"\0" * 10)
+    return path, os.open(path, os.O_RDWR)
+
+@pytest.mark.asyncio
+async def test_worker_writes_through_liburing(tmp_path, monkeypatch):
+    stub = StubLiburing()
+    monkeypatch.setattr(uring_writer, 'liburing', stub)
+    path, fd = _open(tmp_path)
+    engine = IoUringBatchEngine()
+    try:
+        assert engine.uses_uring
+        results = await asyncio.gather(engine.write(fd, 0, b"ab"), engine.write(fd, 5, memoryview(b"xyz")))
+    finally:
+        engine.close()
+        os.close(fd)
+
+    assert results == [2, 3]
+    assert sum(stub.submits) == 2
+    assert path.read_bytes() == b"ab\0\0\0xyz\0\0"
+
+@pytest.mark.asyncio
+async def test_worker_error_fails_pending_and_later_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(uring_writer, 'liburing', StubLiburing(fail_submit=True))
+    path, fd = _open(tmp_path)
+    engine = IoUringBatchEngine()
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(engine.write(fd, 0, b"ab"), engine.write(fd, 5, b"xyz"), return_exceptions=True),
+            timeout=5,
+        )
+        assert all(isinstance(r, OSError) for r in results)
+        with pytest.raises(RuntimeError):
+            await engine.write(fd, 0, b"ab")
+    finally:
+        engine.close()
+        os.close(fd)
+
+@pytest.mark.asyncio
+async def test_worker_cqe_setup_failure_fails_queued_writes(tmp_path, monkeypatch):
+    stub = StubLiburing()
+    def broken_cqe():
+        raise RuntimeError("no cqe")
+    stub.io_uring_cqe = broken_cqe
+    monkeypatch.setattr(uring_writer, 'liburing', stub)
+    path, fd = _open(tmp_path)
+    engine = IoUringBatchEngine()
+    try:
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(engine.write(fd, 0, b"ab"), timeout=5)
+    finally:
+        engine.close()
+        os.close(fd)
+
+@pytest.mark.asyncio
+async def test_real_liburing_binding(tmp_path):
+    real = pytest.importorskip("liburing")
+    if not hasattr(real, 'io_uring'):
+        pytest.skip("installed liburing does not provide the io_uring() API")
+    path, fd = _open(tmp_path)
+    engine = IoUringBatchEngine()
+    try:
+        if not engine.uses_uring:
+            pytest.skip("io_uring is not available on this kernel")
+        results = await asyncio.gather(engine.write(fd, 0, b"ab"), engine.write(fd, 5, memoryview(b"xyz")))
+    finally:
+        engine.close()
+        os.close(fd)
+
+    assert results == [2, 3]
+    assert path.read_bytes() == b"ab\0\0\0xyz\0\0"